@@ -1,10 +1,15 @@
 import unittest
+import json
+import shutil
 import subprocess
 import tempfile
 import time
 import requests
 import signal
+from datetime import date
 from pathlib import Path
+from xml.etree import ElementTree
+from yogen.sitemap import Sitemap
 
 class TestCLI(unittest.TestCase):
 
@@ -112,7 +117,7 @@ class TestCLI(unittest.TestCase):
 
             # Start the server in a separate process
             proc = subprocess.Popen(
-                ["yogen", "serve", "8001"],
+                ["yogen", "serve", "8001", "--metrics-log", "metrics.jsonl"],
                 cwd=site_path,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
@@ -128,7 +133,421 @@ class TestCLI(unittest.TestCase):
                 self.assertEqual(resp.status_code, 200)
                 self.assertIn("<html", resp.text)
 
+                # pages are converted on first request
+                resp = requests.get("http://127.0.0.1:8001/posts/example-post/")
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Welcome to the example post", resp.text)
+
+                # rebuild metrics
+                resp = requests.get("http://127.0.0.1:8001/_yogen/status")
+                self.assertEqual(resp.status_code, 200)
+                status = resp.json()
+                self.assertEqual(status["queue"]["pages"], 4)
+                self.assertIn("page.render_seconds", status["histograms"])
+
+                # a rebuild is logged once every page and index is written
+                for _ in range(50):
+                    if requests.get("http://127.0.0.1:8001/_yogen/status").json()["queue"]["indexed"]:
+                        break
+                    time.sleep(0.1)
+                lines = [json.loads(l) for l in (site_path / "metrics.jsonl").read_text(encoding="utf-8").splitlines()]
+                rebuild = [l for l in lines if l["event"] == "rebuild"]
+                self.assertEqual([(l["kind"], l["pages"]) for l in rebuild], [("all", 4)])
+
+                # the preview never replaces the build folder
+                self.assertTrue((site_path / "build.preview" / "posts" / "example-post" / "index.html").is_file())
+                self.assertFalse((site_path / "build").exists())
+
             finally:
                 # Terminate the server
                 proc.send_signal(signal.SIGINT)
-                proc.wait(timeout=5)
\ No newline at end of file
+                proc.wait(timeout=5)
+
+    def test_yogen_serve_incremental(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+
+            config_path = site_path / "yogen.toml"
+            config = config_path.read_text(encoding="utf-8")
+            config = config.replace("section_feeds = false", "section_feeds = true")
+            config = config.replace("tag_feeds = false", "tag_feeds = true")
+            config_path.write_text(config, encoding="utf-8")
+
+            proc = subprocess.Popen(
+                ["yogen", "serve", "8002"],
+                cwd=site_path,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+
+            def wait_for_rebuilds(count):
+                for _ in range(100):
+                    try:
+                        status = requests.get("http://127.0.0.1:8002/_yogen/status").json()
+                        if status["histograms"].get("rebuild.pages", {}).get("count") == count:
+                            return
+                    except requests.ConnectionError:
+                        pass
+                    time.sleep(0.1)
+                self.fail(f"no rebuild #{count}")
+
+            def snapshot():
+                return {
+                    p.relative_to(preview_path).as_posix(): p.stat().st_mtime_ns
+                    for p in preview_path.rglob("*") if p.is_file()
+                }
+
+            try:
+                preview_path = site_path / "build.preview"
+                wait_for_rebuilds(1)
+                before = snapshot()
+
+                # new date and one new word: only the outputs depending on them are rewritten
+                time.sleep(0.05)
+                post = site_path / "content" / "posts" / "example-post" / "index.md"
+                text = post.read_text(encoding="utf-8")
+                text = text.replace('date = "2011-11-11"', 'date = "2012-12-12"').replace("Welcome", "Welcome zebra")
+                post.write_text(text, encoding="utf-8")
+                wait_for_rebuilds(2)
+
+                after = snapshot()
+                self.assertEqual(sorted(f for f in after if before.get(f) != after[f]), [
+                    "feed.xml",
+                    "posts/example-post/index.html",
+                    "posts/feed.xml",
+                    "search/index.json",                # lists the new shard
+                    "search/shards/ze.json",
+                    "sitemap.xml",
+                    "tags/another-tag/feed.xml",
+                    "tags/some-tag/feed.xml",
+                ])
+
+                # a deleted page is removed from the output and every index
+                post.unlink()
+                wait_for_rebuilds(3)
+                deleted = snapshot()
+                for file in ("posts/example-post/index.html", "search/shards/ze.json", "tags/some-tag/feed.xml"):
+                    self.assertNotIn(file, deleted)
+                self.assertEqual(deleted["about/index.html"], after["about/index.html"])
+                self.assertNotIn("example-post", (preview_path / "sitemap.xml").read_text(encoding="utf-8"))
+                self.assertNotIn("example-post", (preview_path / "search" / "index.json").read_text(encoding="utf-8"))
+                self.assertNotIn("example-post", (preview_path / "feed.xml").read_text(encoding="utf-8"))
+
+                # a failed index update is reported and retried on the next change
+                about = site_path / "content" / "about" / "index.md"
+                text = about.read_text(encoding="utf-8")
+                about.write_text(text.replace('tags = ["about"]', 'tags = ["C++", "C#"]'), encoding="utf-8")
+                for _ in range(100):
+                    error = requests.get("http://127.0.0.1:8002/_yogen/status").json()["queue"]["error"]
+                    if error:
+                        break
+                    time.sleep(0.1)
+                self.assertIn("Output path collision", error)
+
+                about.write_text(text.replace('tags = ["about"]', 'tags = ["C++"]'), encoding="utf-8")
+                wait_for_rebuilds(4)
+                status = requests.get("http://127.0.0.1:8002/_yogen/status").json()
+                self.assertIsNone(status["queue"]["error"])
+                self.assertTrue((preview_path / "tags" / "c" / "feed.xml").is_file())
+
+            finally:
+                proc.send_signal(signal.SIGINT)
+                proc.wait(timeout=5)
+
+    def test_yogen_build_search_index(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0)
+
+            search_path = site_path / "build" / "search"
+            index = json.loads((search_path / "index.json").read_text(encoding="utf-8"))
+            self.assertIn("lo", index["shards"])
+
+            # the example post is the only page mentioning "lorem"
+            shard = json.loads((search_path / "shards" / "lo.json").read_text(encoding="utf-8"))
+            [page_id] = shard["lorem"]
+            document = index["documents"][str(page_id)]
+            self.assertEqual(document["url"], "/posts/example-post/")
+            self.assertEqual(document["section"], "posts")
+            self.assertIn("some tag", document["tags"])
+
+            # the next build starts from the cached index: the edited page moves to other shards,
+            # the untouched shards are hardlinked from the previous build
+            post = site_path / "content" / "posts" / "example-post" / "index.md"
+            post.write_text(post.read_text(encoding="utf-8").replace("Lorem", "Zebra").replace("lorem", "zebra"), encoding="utf-8")
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertTrue((site_path / ".yogen" / "search-en.json").is_file())
+
+            previous_path = site_path / "build.previous" / "search"
+            self.assertFalse((search_path / "shards" / "lo.json").exists())
+            self.assertIn("zebra", json.loads((search_path / "shards" / "ze.json").read_text(encoding="utf-8")))
+            self.assertTrue((search_path / "shards" / "ab.json").samefile(previous_path / "shards" / "ab.json"))
+
+            # same index as a build from scratch
+            incremental = {p.relative_to(search_path): p.read_bytes() for p in search_path.rglob("*.json")}
+            (site_path / ".yogen" / "search-en.json").unlink()
+            subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual({p.relative_to(search_path): p.read_bytes() for p in search_path.rglob("*.json")}, incremental)
+
+    def test_yogen_build_sitemap(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0)
+
+            sitemap = ElementTree.parse(site_path / "build" / "sitemap.xml").getroot()
+            ns = {"sm": "http://www.sitemaps.org/schemas/sitemap/0.9"}
+            entries = {
+                url.find("sm:loc", ns).text: url.find("sm:lastmod", ns).text
+                for url in sitemap.findall("sm:url", ns)
+            }
+            self.assertEqual(entries["https://example.com/posts/example-post/"], "2011-11-11")
+            self.assertIn("https://example.com/about/", entries)
+
+    def test_sitemap_chunks(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_path = Path(tmpdir)
+            sitemap = Sitemap(output_path, "https://example.com", max_urls=3)
+            for name in "bcdefgh":
+                sitemap.update(f"/{name}/", date(2011, 11, 11))
+            sitemap.write()
+            self.assertEqual(sorted(p.name for p in output_path.iterdir()), [
+                "sitemap-1.xml", "sitemap-2.xml", "sitemap-3.xml", "sitemap.xml",
+            ])
+
+            # a new url takes a free slot, the other chunks are left alone
+            inodes = {p.name: p.stat().st_ino for p in output_path.iterdir()}
+            sitemap.update("/a-new/", date(2011, 11, 11))
+            sitemap.write()
+            changed = sorted(p.name for p in output_path.iterdir() if inodes.get(p.name) != p.stat().st_ino)
+            self.assertEqual(changed, ["sitemap-3.xml"])
+
+            # and a removed url frees its slot in its own chunk only
+            inodes = {p.name: p.stat().st_ino for p in output_path.iterdir()}
+            sitemap.remove("/c/")
+            sitemap.write()
+            changed = sorted(p.name for p in output_path.iterdir() if inodes.get(p.name) != p.stat().st_ino)
+            self.assertEqual(changed, ["sitemap-1.xml"])
+
+            # chunks are taken back from the files of a previous build
+            restored = Sitemap(output_path, "https://example.com", max_urls=3)
+            restored.restore(output_path)
+            self.assertEqual(restored.chunk_of, sitemap.chunk_of)
+
+    def test_yogen_build_languages(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+
+            # one content tree per language
+            content_path = site_path / "content"
+            default_content = tmp_path / "content"
+            shutil.move(content_path, default_content)
+            for lang in ("en", "es"):
+                shutil.copytree(default_content, content_path / lang)
+
+            config_path = site_path / "yogen.toml"
+            config = config_path.read_text(encoding="utf-8")
+            config_path.write_text(config.replace('languages = ["en"]', 'languages = ["en", "es"]'), encoding="utf-8")
+
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+            build_path = site_path / "build"
+            self.assertTrue((build_path / "posts" / "example-post" / "index.html").is_file())
+            self.assertTrue((build_path / "es" / "posts" / "example-post" / "index.html").is_file())
+            self.assertTrue((build_path / "style.css").is_file())
+
+            for feed, lang in ((build_path / "feed.xml", "en"), (build_path / "es" / "feed.xml", "es")):
+                channel = ElementTree.parse(feed).getroot().find("channel")
+                self.assertEqual(channel.find("language").text, lang)
+            es_links = ElementTree.parse(build_path / "es" / "feed.xml").getroot().iter("link")
+            self.assertIn("https://example.com/es/posts/example-post/", [l.text for l in es_links])
+
+            # the root sitemap indexes every language's sitemap
+            ns = {"sm": "http://www.sitemaps.org/schemas/sitemap/0.9"}
+            index = ElementTree.parse(build_path / "sitemap.xml").getroot()
+            self.assertEqual(
+                sorted(s.find("sm:loc", ns).text for s in index.findall("sm:sitemap", ns)),
+                ["https://example.com/es/sitemap.xml", "https://example.com/sitemap-en.xml"],
+            )
+            urls = ElementTree.parse(build_path / "sitemap-en.xml").getroot().findall("sm:url", ns)
+            self.assertIn("https://example.com/posts/example-post/", [u.find("sm:loc", ns).text for u in urls])
+
+            # the pages built by the language workers are checked too
+            result = subprocess.run(["yogen", "build", "--check"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+            self.assertIn("Checked 8 pages", result.stdout)
+
+            # content no language would build is an error, not silently skipped
+            (content_path / "notes.md").write_text("# Notes", encoding="utf-8")
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("Content outside of every language folder", result.stderr)
+
+            (content_path / "notes.md").unlink()
+            shutil.rmtree(content_path / "es")
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("Missing content folder for language 'es'", result.stderr)
+
+    def test_yogen_check(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+
+            result = subprocess.run(["yogen", "build", "--check"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+            self.assertIn("Checked 4 pages (4 parsed", result.stdout)
+
+            about = site_path / "content" / "about" / "index.md"
+            about.write_text(about.read_text(encoding="utf-8") + "\n![photo](photo.png) [old](/posts/renamed/)\n", encoding="utf-8")
+            subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+
+            result = subprocess.run(["yogen", "check"], cwd=site_path, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("Checked 4 pages (1 parsed", result.stdout)     # the unchanged pages come from the cache
+            self.assertIn(f"{Path('content/about/index.md')}: broken reference 'photo.png'", result.stdout)
+            self.assertIn("broken reference '/posts/renamed/'", result.stdout)
+            self.assertNotIn("example-post", result.stdout)
+
+            # the missing image is copied along with the page
+            (about.parent / "photo.png").write_bytes(b"")
+            subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            result = subprocess.run(["yogen", "check"], cwd=site_path, capture_output=True, text=True)
+            self.assertIn("Checked 4 pages (0 parsed", result.stdout)
+            self.assertNotIn("photo.png", result.stdout)
+
+    def test_yogen_build_swap(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+            build_path = site_path / "build"
+
+            subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            about = site_path / "content" / "about" / "index.md"
+            about.write_text(about.read_text(encoding="utf-8") + "\nsecond build\n", encoding="utf-8")
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+            # the previous generation is kept, unchanged files are shared with it
+            previous_path = site_path / "build.previous"
+            self.assertNotIn("second build", (previous_path / "about" / "index.html").read_text(encoding="utf-8"))
+            self.assertIn("second build", (build_path / "about" / "index.html").read_text(encoding="utf-8"))
+            self.assertTrue((build_path / "style.css").samefile(previous_path / "style.css"))
+            # unchanged pages, feeds and indexes are hardlinked from the previous build too
+            for file in ("posts/example-post/index.html", "feed.xml", "sitemap.xml", "search/shards/po.json"):
+                self.assertTrue((build_path / file).samefile(previous_path / file), file)
+            self.assertFalse((site_path / "build.staging").exists())
+
+            # a failed build leaves the live site alone
+            about.write_text("+++\ndate = \"not a date\"\n+++\n", encoding="utf-8")
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("second build", (build_path / "about" / "index.html").read_text(encoding="utf-8"))
+            self.assertFalse((site_path / "build.staging").exists())
+
+            result = subprocess.run(["yogen", "rollback"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertNotIn("second build", (build_path / "about" / "index.html").read_text(encoding="utf-8"))
+
+    def test_yogen_build_shards(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+
+            subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            full_build = {
+                p.relative_to(site_path / "build"): p.read_bytes()
+                for p in (site_path / "build").rglob("*") if p.is_file()
+            }
+
+            for shard in ("1/3", "2/3", "3/3"):
+                result = subprocess.run(["yogen", "build", "--shard", shard], cwd=site_path, capture_output=True, text=True)
+                self.assertEqual(result.returncode, 0, result.stderr)
+
+            # markdown is not converted again: the merge works from the bundles alone
+            shutil.rmtree(site_path / "content")
+            result = subprocess.run(["yogen", "merge"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+            merged_build = {
+                p.relative_to(site_path / "build"): p.read_bytes()
+                for p in (site_path / "build").rglob("*") if p.is_file()
+            }
+            self.assertEqual(full_build.keys(), merged_build.keys())
+            for path in ("posts/example-post/index.html", "sitemap.xml", "search/index.json"):
+                self.assertEqual(full_build[Path(path)], merged_build[Path(path)], path)
+            self.assertIn(b"Welcome to the example post", merged_build[Path("feed.xml")])
+
+            # missing shards are refused
+            shutil.rmtree(site_path / "build.shard-2-of-3")
+            result = subprocess.run(["yogen", "merge"], cwd=site_path, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+
+    def test_yogen_build_section_and_tag_feeds(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_path = Path(tmpdir)
+            site_name = "newsite"
+
+            subprocess.run(["yogen", "create", site_name], cwd=tmp_path, capture_output=True, text=True)
+            site_path = tmp_path / site_name
+
+            config_path = site_path / "yogen.toml"
+            config = config_path.read_text(encoding="utf-8")
+            config = config.replace('formats = ["rss"]', 'formats = ["rss", "atom"]')
+            config = config.replace("section_feeds = false", "section_feeds = true")
+            config = config.replace("tag_feeds = false", "tag_feeds = true")
+            config_path.write_text(config, encoding="utf-8")
+
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+            build_path = site_path / "build"
+            for folder in (build_path, build_path / "posts", build_path / "tags" / "some-tag", build_path / "tags" / "another-tag"):
+                rss = ElementTree.parse(folder / "feed.xml").getroot()
+                self.assertEqual([l.text for l in rss.iter("link")][-1], "https://example.com/posts/example-post/")
+
+                atom = ElementTree.parse(folder / "atom.xml").getroot()
+                entries = atom.findall("{http://www.w3.org/2005/Atom}entry")
+                self.assertEqual(len(entries), 1)
+
+            # the empty tag of the home pages gets no feed
+            self.assertEqual(sorted(p.name for p in (build_path / "tags").iterdir()), ["about", "another-tag", "some-tag"])
+
+            # tags whose slugs collide would overwrite each other's feed
+            post = site_path / "content" / "posts" / "example-post" / "index.md"
+            post.write_text(post.read_text(encoding="utf-8").replace('"some tag", "another tag"', '"C++", "C#"'), encoding="utf-8")
+            result = subprocess.run(["yogen", "build"], cwd=site_path, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("Output path collision", result.stderr)
+            self.assertEqual(sorted(p.name for p in (build_path / "tags").iterdir()), ["about", "another-tag", "some-tag"])
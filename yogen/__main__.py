@@ -3,9 +3,11 @@ import shutil
 from yogen.website import Site
 from yogen.page import Page
 from yogen.watcher import WatchDogHandler
+from yogen.server import RenderQueue, PreviewHandler
+from functools import partial
 from importlib import resources
 from pathlib import Path
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import HTTPServer
 from watchdog.observers import Observer
 
 CONFIG_PATH = "yogen.toml"
@@ -16,6 +18,15 @@ def yogen_folder_check():
             "not a yogen site. Run 'yogen create <name>'."
         )
 
+def parse_shard(value : str) -> tuple[int, int]:
+    try:
+        index, count = (int(n) for n in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got '{value}'")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard must be between 1/{count} and {count}/{count}")
+    return index, count
+
 def parse_arguments():
     parser = argparse.ArgumentParser()
     sub = parser.add_subparsers(dest="cmd", required=True)
@@ -23,10 +34,20 @@ def parse_arguments():
     create_p = sub.add_parser("create")
     create_p.add_argument("name")
 
-    sub.add_parser("build")
+    build_p = sub.add_parser("build")
+    build_p.add_argument("--check", action="store_true", help="check internal links after building")
+    build_p.add_argument("--shard", type=parse_shard, metavar="I/N", help="only build shard I of N, combine them with 'yogen merge'")
+
+    sub.add_parser("check")
+
+    merge_p = sub.add_parser("merge")
+    merge_p.add_argument("shards", nargs="*", type=Path, help="shard folders, defaults to every shard of the build folder")
 
     serve_p = sub.add_parser("serve")
     serve_p.add_argument("port", type=int, nargs="?", default=8000)
+    serve_p.add_argument("--metrics-log", type=Path, metavar="FILE", help="append rebuild metrics to FILE as JSON lines")
+
+    sub.add_parser("rollback")
 
     sub.add_parser("deploy")
 
@@ -43,9 +64,14 @@ def cmd_create(name : str):
         shutil.copytree(src, root)
 
 
-def cmd_build():
+def cmd_build(check : bool = False, shard : tuple[int, int] | None = None):
     site : Site = Site(Path(CONFIG_PATH))
+    if shard:
+        print("Shard written to", site.build_shard(*shard))
+        return
     site.build()
+    if check:
+        report_broken_links(site)
     # print("SECTIONS")
     # for k, v in site.sections.items():
     #     print(k, "->", [str(p.file) for p in v])
@@ -62,25 +88,56 @@ def cmd_build():
     # for p, tags in site.page_tags.items():
     #     print(str(p.file), "->", list(tags))
 
-def cmd_serve(port : int):
+def cmd_serve(port : int, metrics_log : Path | None = None):
     site : Site = Site(Path(CONFIG_PATH))
-    site.build()
+    site.metrics.log_file = metrics_log
+
+    # pages are converted when first requested, the rest in the background
+    queue : RenderQueue = RenderQueue(site)
+    queue.start()
 
-    event_handler : WatchDogHandler = WatchDogHandler()
-    event_handler.on_rebuild_all = site.build
-    event_handler.on_rebuild_md = site.rebuild_md
+    event_handler : WatchDogHandler = WatchDogHandler(metrics=site.metrics)
+    event_handler.on_rebuild_all = queue.rebuild_all
+    event_handler.on_rebuild_md = queue.rebuild_md
 
     observer = Observer()
     # TODO watch templates folder: on any event, rebuild
     observer.schedule(event_handler, site.content_path, recursive=True)
     observer.start()
 
-    http_handler = lambda *a, **kw: SimpleHTTPRequestHandler(
-        *a, directory=str(site.build_path), **kw
-    )
+    http_handler = partial(PreviewHandler, queue=queue, directory=str(site.preview_path))
 
     HTTPServer(("127.0.0.1", port), http_handler).serve_forever()
 
+def report_broken_links(site : Site):
+    broken = site.check()
+    counters = site.metrics.counters
+    print(f"Checked {counters['check.pages']} pages ({counters['check.pages_parsed']} parsed, the rest cached)")
+    for source, reference in broken:
+        print(f"{source}: broken reference '{reference}'")
+    if broken:
+        raise SystemExit(f"{len(broken)} broken reference(s)")
+
+def cmd_check():
+    site : Site = Site(Path(CONFIG_PATH))
+    if not site.build_path.is_dir():
+        raise SystemExit("build folder not found. Run `yogen build`.")
+    report_broken_links(site)
+
+def cmd_merge(shards : list[Path]):
+    site : Site = Site(Path(CONFIG_PATH))
+    if not shards:
+        shards = sorted(site.build_root.parent.glob(f"{site.build_root.name}.shard-*"))
+    if not shards:
+        raise SystemExit("no shards found. Run `yogen build --shard I/N`.")
+    site.merge(shards)
+
+def cmd_rollback():
+    site : Site = Site(Path(CONFIG_PATH))
+    if not site.rollback():
+        raise SystemExit("no previous build to roll back to.")
+    print(f"{site.build_root} swapped with {site.previous_path}")
+
 def cmd_deploy():
     site : Site = Site(Path(CONFIG_PATH))
     site.deploy()
@@ -94,10 +151,19 @@ def main():
             cmd_create(args.name)
         case "build":
             yogen_folder_check()
-            cmd_build()
+            cmd_build(args.check, args.shard)
+        case "merge":
+            yogen_folder_check()
+            cmd_merge(args.shards)
+        case "check":
+            yogen_folder_check()
+            cmd_check()
         case "serve":
             yogen_folder_check()
-            cmd_serve(args.port)
+            cmd_serve(args.port, args.metrics_log)
+        case "rollback":
+            yogen_folder_check()
+            cmd_rollback()
         case "deploy":
             yogen_folder_check()
             cmd_deploy()
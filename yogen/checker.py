@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import posixpath
+from pathlib import Path
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, unquote
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 64 * 1024
+
+class ReferenceParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.references : list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name in ("href", "src") and value:
+                self.references.append(value)
+
+
+def _parse_references(file : Path) -> list[str]:
+    # runs in a worker process, the file is fed to the parser in chunks
+    parser : ReferenceParser = ReferenceParser()
+    with file.open(encoding="utf-8", errors="replace") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            parser.feed(chunk)
+    parser.close()
+    return parser.references
+
+
+def _digest(file : Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with file.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LinkChecker:
+    """Checks internal href/src references of the generated html against the build output.
+
+    Parsed references are cached per page (by content digest), so only pages
+    that changed, or that point at outputs that appeared or disappeared, are
+    checked again.
+    """
+    def __init__(self, build_path : Path, cache_file : Path):
+        self.build_path : Path = build_path
+        self.cache_file : Path = cache_file
+
+        self.outputs : set[str] = set()                 # output files relative to build_path
+        self.pages : dict[str, dict] = {}               # html file -> digest, targets, broken
+        self.parsed : int = 0                           # pages parsed by the last check, the others came from the cache
+        if cache_file.is_file():
+            try:
+                cache = json.loads(cache_file.read_text(encoding="utf-8"))
+                self.outputs = set(cache["outputs"])
+                self.pages = cache["pages"]
+            except (ValueError, KeyError):
+                pass    # stale or corrupt cache, check everything
+
+    def resolve(self, page : str, reference : str) -> list[str] | None:
+        """Candidate output files for a reference, None when it is not internal"""
+        url = urlsplit(reference)
+        if url.scheme or url.netloc or not url.path:
+            return None
+
+        path : str = unquote(url.path)
+        if not path.startswith("/"):
+            path = posixpath.join("/" + posixpath.dirname(page), path)
+        target : str = posixpath.normpath(path).lstrip("/")
+        if target == ".":
+            target = ""
+
+        if path.endswith("/") or not target:
+            return [posixpath.join(target, "index.html")]
+        if not posixpath.splitext(target)[1]:
+            return [target, posixpath.join(target, "index.html")]
+        return [target]
+
+    def check(self, sources : dict[str, Path] | None = None) -> list[tuple[str, str]]:
+        """Return (source, reference) for every broken reference.
+
+        `sources` maps generated html files to the markdown they come from.
+        """
+        sources = sources or {}
+        outputs : set[str] = set()
+        for root, _, files in os.walk(self.build_path):
+            for name in files:
+                outputs.add((Path(root) / name).relative_to(self.build_path).as_posix())
+        changed_outputs : set[str] = (outputs - self.outputs) | (self.outputs - outputs)
+        self.outputs = outputs
+
+        html_files : list[str] = sorted(o for o in outputs if o.endswith(".html"))
+        for stale in set(self.pages) - set(html_files):
+            del self.pages[stale]
+
+        digests : dict[str, str] = {f: _digest(self.build_path / f) for f in html_files}
+        changed_pages : list[str] = [f for f in html_files if self.pages.get(f, {}).get("digest") != digests[f]]
+        self.parsed = len(changed_pages)
+
+        if changed_pages:
+            with ProcessPoolExecutor() as pool:
+                parsed = pool.map(_parse_references, [self.build_path / f for f in changed_pages], chunksize=16)
+                for file, references in zip(changed_pages, parsed):
+                    targets : dict[str, list[str]] = {}
+                    for reference in references:
+                        candidates = self.resolve(file, reference)
+                        if candidates is not None:
+                            targets[reference] = candidates
+                    self.pages[file] = {"digest": digests[file], "targets": targets, "broken": None}
+
+        broken : list[tuple[str, str]] = []
+        for file in html_files:
+            page : dict = self.pages[file]
+            recheck : bool = page["broken"] is None or any(
+                c in changed_outputs for candidates in page["targets"].values() for c in candidates
+            )
+            if recheck:
+                page["broken"] = [
+                    reference for reference, candidates in page["targets"].items()
+                    if not any(c in outputs for c in candidates)
+                ]
+            source : str = str(sources.get(file, self.build_path / file))
+            broken.extend((source, reference) for reference in page["broken"])
+
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_file.write_text(
+            json.dumps({"outputs": sorted(self.outputs), "pages": self.pages}, separators=(",", ":")),
+            encoding="utf-8",
+        )
+
+        return broken
@@ -17,6 +17,9 @@ def load_config(root: Path):
     for key in ("static", "content", "templates", "build"):
         if key not in paths or not isinstance(paths[key], str):
             raise KeyError(f"Missing or invalid paths.{key}")
+    paths.setdefault("cache", ".yogen")
+    if not isinstance(paths["cache"], str):
+        raise TypeError("paths.cache must be a string")
 
     # site section
     site = config.get("site")
@@ -59,6 +62,30 @@ def load_config(root: Path):
         raise TypeError("feed.sections must be a list of strings")
     if not isinstance(feed["tags"], list) or not all(isinstance(t, str) for t in feed["tags"]):
         raise TypeError("feed.tags must be a list of strings")
+    feed.setdefault("atom_output", "atom.xml")
+    feed.setdefault("formats", ["rss"])
+    feed.setdefault("section_feeds", False)
+    feed.setdefault("tag_feeds", False)
+    if not isinstance(feed["atom_output"], str):
+        raise TypeError("feed.atom_output must be a string")
+    if not isinstance(feed["formats"], list) or not all(f in ("rss", "atom") for f in feed["formats"]):
+        raise TypeError("feed.formats must be a list of \"rss\" and/or \"atom\"")
+    for key in ("section_feeds", "tag_feeds"):
+        if not isinstance(feed[key], bool):
+            raise TypeError(f"feed.{key} must be a boolean")
 
+    # search section (optional)
+    search = config.setdefault("search", {})
+    if not isinstance(search, dict):
+        raise KeyError("Invalid [search] section")
+    search.setdefault("enabled", True)
+    search.setdefault("output", "search")
+    search.setdefault("prefix_length", 2)
+    if not isinstance(search["enabled"], bool):
+        raise TypeError("search.enabled must be a boolean")
+    if not isinstance(search["output"], str):
+        raise TypeError("search.output must be a string")
+    if not isinstance(search["prefix_length"], int) or search["prefix_length"] < 1:
+        raise TypeError("search.prefix_length must be a positive integer")
 
     return config
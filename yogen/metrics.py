@@ -0,0 +1,142 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)     # seconds
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)     # pages, events
+SLOWEST_PAGES = 10
+
+class Histogram:
+    def __init__(self, buckets : tuple[float, ...] = BUCKETS):
+        self.buckets : tuple[float, ...] = buckets
+        self.counts : list[int] = [0] * (len(buckets) + 1)     # last one is +Inf
+        self.count : int = 0
+        self.sum : float = 0.0
+        self.min : float | None = None
+        self.max : float | None = None
+
+    def observe(self, value : float):
+        i : int = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other : "Histogram"):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {
+                **{str(le): n for le, n in zip(self.buckets, self.counts)},
+                "+Inf": self.counts[-1],
+            },
+        }
+
+
+class Metrics:
+    """Histograms, counters and gauges about builds and rebuilds.
+
+    Exposed by `yogen serve` on /_yogen/status, and appended as JSON lines
+    to `log_file` when one is given.
+    """
+    def __init__(self, log_file : Path | None = None):
+        self.log_file : Path | None = log_file
+        self.histograms : dict[str, Histogram] = {}
+        self.counters : dict[str, int] = {}
+        self.gauges : dict[str, float] = {}
+        self.slowest_pages : list[tuple[float, str]] = []     # (seconds, file), slowest first
+        self._lock : threading.Lock = threading.Lock()
+
+    def __getstate__(self):
+        # sent to language worker processes, which must not append to the log
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["log_file"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def observe(self, name : str, value : float, buckets : tuple[float, ...] = BUCKETS):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram(buckets)).observe(value)
+
+    def increment(self, name : str, amount : int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name : str, value : float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe_page(self, file : Path, seconds : float):
+        self.observe("page.render_seconds", seconds)
+        with self._lock:
+            self.slowest_pages.append((seconds, str(file)))
+            self.slowest_pages.sort(reverse=True)
+            del self.slowest_pages[SLOWEST_PAGES:]
+
+    @contextmanager
+    def phase(self, name : str):
+        start : float = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds : float = time.perf_counter() - start
+            self.observe(f"phase.{name}.seconds", seconds)
+            self.log("phase", phase=name, seconds=seconds)
+
+    def merge(self, other : "Metrics"):
+        with self._lock:
+            for name, histogram in other.histograms.items():
+                self.histograms.setdefault(name, Histogram(histogram.buckets)).merge(histogram)
+            for name, value in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(other.gauges)
+            self.slowest_pages = sorted(self.slowest_pages + other.slowest_pages, reverse=True)[:SLOWEST_PAGES]
+
+    def log(self, event : str, **fields):
+        if self.log_file is None:
+            return
+        line : str = json.dumps({"time": time.time(), "event": event, **fields}, default=str)
+        with self._lock, self.log_file.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "histograms": {name: h.to_dict() for name, h in self.histograms.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "slowest_pages": [{"file": file, "seconds": s} for s, file in self.slowest_pages],
+            }
+
+
+def timed(phase : str):
+    """Record the duration of a `Site` method as a build phase"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.phase(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
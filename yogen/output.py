@@ -0,0 +1,108 @@
+import ctypes
+import filecmp
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+def exchange_paths(a : Path, b : Path) -> bool:
+    """Atomically swap two paths with renameat2(RENAME_EXCHANGE), False when unsupported"""
+    if sys.platform != "linux":
+        return False
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    return renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE) == 0
+
+
+def publish(staging : Path, live : Path, previous : Path):
+    """Switch `staging` in as `live`, keeping the replaced generation as `previous`"""
+    if not live.exists():
+        os.rename(staging, live)
+        return
+
+    if previous.exists():
+        shutil.rmtree(previous)
+
+    if exchange_paths(staging, live):
+        os.rename(staging, previous)
+    else:
+        # two renames: live is missing for a moment, never half written
+        os.rename(live, previous)
+        os.rename(staging, live)
+
+
+def rollback(live : Path, previous : Path) -> bool:
+    if not previous.is_dir():
+        return False
+    if not exchange_paths(previous, live):
+        swap : Path = live.with_name(f"{live.name}.swap")
+        os.rename(live, swap)
+        os.rename(previous, live)
+        os.rename(swap, previous)
+    return True
+
+
+def _link(source : Path, target : Path) -> bool:
+    try:
+        target.unlink(missing_ok=True)
+        os.link(source, target)
+        return True
+    except OSError:
+        return False
+
+
+def write_output(target : Path, text : str, previous : Path | None = None):
+    """Write a generated file, hardlinking `previous` instead when its content is the same.
+
+    Files are replaced rather than written in place, since their inode
+    may be shared with the previous generation.
+    """
+    data : bytes = text.encode("utf-8")
+    if (previous is not None and previous.is_file()
+            and previous.stat().st_size == len(data) and previous.read_bytes() == data
+            and _link(previous, target)):
+        return
+
+    with open_output(target, "wb") as f:
+        f.write(data)
+
+
+@contextmanager
+def open_output(target : Path, mode : str = "w", previous : Path | None = None):
+    """Open a temporary file that replaces `target` once it is fully written.
+
+    Readers never see a half written file, and an inode shared with the
+    previous generation is never modified. When the result is the same as
+    `previous`, that file is hardlinked instead.
+    """
+    temp : Path = target.with_name(f".{target.name}.tmp")
+    try:
+        with temp.open(mode, encoding=None if "b" in mode else "utf-8") as f:
+            yield f
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+    if (previous is not None and previous.is_file()
+            and previous.stat().st_size == temp.stat().st_size
+            and filecmp.cmp(previous, temp, shallow=False) and _link(previous, target)):
+        temp.unlink()
+        return
+    os.replace(temp, target)
+
+
+def copy_output(source : Path, target : Path, previous : Path | None = None):
+    """Copy a file, hardlinking `previous` instead when it is an unchanged copy of `source`"""
+    if previous is not None and previous.is_file():
+        src_stat, prev_stat = source.stat(), previous.stat()
+        if (src_stat.st_size == prev_stat.st_size and src_stat.st_mtime_ns == prev_stat.st_mtime_ns
+                and _link(previous, target)):
+            return
+    shutil.copy2(source, target)
@@ -2,13 +2,12 @@ import tomllib
 import markdown
 import ast
 import re
-from yogen.config import load_config
 from pathlib import Path
 from datetime import date, datetime
 
 class Page():
-    def __init__(self, md_file : Path, config_file : Path, content_path : Path):
-        self.config = load_config(config_file)
+    def __init__(self, md_file : Path, config : dict, content_path : Path):
+        self.config = config
         self.file : Path = md_file
         self.__fields = {
             "title" : self._define_title(md_file, content_path),
@@ -18,7 +17,9 @@ class Page():
             "section" : "global",
             "tags" : []
         }
-        meta, self.raw_html = self._parse_page()
+        meta, self._markdown = self._parse_page()     # markdown is converted on first use of page.content
+        self.meta : dict = meta             # front matter as written by the user
+        self._lastmod : date | None = None
         protected = {"content", "raw"}      # fields users cannot set
         for k, v in meta.items():
             if k == "date":
@@ -28,6 +29,30 @@ class Page():
             else:
                 raise ValueError(f"metadata field '{k}' is protected and cannot be set")
     
+    @classmethod
+    def from_metadata(cls, data : dict, config : dict) -> "Page":
+        """Rebuild a converted page from `to_metadata` output, without reading the markdown file"""
+        page : Page = cls.__new__(cls)
+        page.config = config
+        page.file = Path(data["file"])
+        page.meta = data["meta"]
+        page._markdown = ""
+        page._lastmod = date.fromisoformat(data["lastmod"])
+        page.__fields = dict(data["fields"])
+        page.__fields["date"] = date.fromisoformat(data["fields"]["date"])
+        return page
+
+    def to_metadata(self) -> dict:
+        fields : dict = dict(self.__fields)
+        fields["content"] = self.get_field("content")
+        fields["date"] = self.get_field("date").isoformat()
+        return {
+            "file": self.file.as_posix(),
+            "meta": self.meta,
+            "lastmod": self.lastmod().isoformat(),
+            "fields": fields,
+        }
+
     def __hash__(self):
         return hash(self.file)
     
@@ -39,6 +64,8 @@ class Page():
     def get_field(self, key : str) -> object | None:
         if not key in self.__fields:
             return None
+        if key == "content" and self.__fields[key] is None:
+            self._convert()
         return self.__fields[key]
 
     def has_field(self, key : str) -> bool:
@@ -87,13 +114,20 @@ class Page():
             return ""  # fallback
         return d.strftime(fmt)
 
+    def lastmod(self) -> date:
+        """Front matter date if set, otherwise the source file modification date"""
+        if self._lastmod is not None:
+            return self._lastmod
+        if "date" in self.meta:
+            return self.get_field("date")
+        return date.fromtimestamp(self.file.stat().st_mtime)
+
     def _parse_page(self) -> tuple[dict, str]:
         FRONT_MATTER_DELIM = "+++"
 
         meta = {}
         raw = ""
 
-        md : markdown.Markdown = markdown.Markdown(extensions=["footnotes", "tables", "def_list", "toc", 'markdown_captions'])
         md_text : str = self.file.read_text(encoding="utf-8")
 
         lines = md_text.splitlines()
@@ -116,12 +150,14 @@ class Page():
         else:
             # no front matter
             raw = "\n".join(lines)
-        
-        raw_html : str = md.convert(raw)
 
-        self.__fields["content"] = raw_html
-        
-        return meta, raw_html
+        self.__fields["content"] = None
+
+        return meta, raw
+
+    def _convert(self):
+        md : markdown.Markdown = markdown.Markdown(extensions=["footnotes", "tables", "def_list", "toc", 'markdown_captions'])
+        self.__fields["content"] = md.convert(self._markdown)
 
     
     def _replace_placeholders(self, _content : str) -> str:
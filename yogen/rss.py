@@ -1,45 +1,101 @@
-import json
 from feedgen.feed import FeedGenerator
+from feedgen.entry import FeedEntry
 from pathlib import Path
-from yogen.config import load_config
 from yogen.page import Page
+from yogen.output import write_output
 from datetime import datetime, date, timezone
 
-class MarkdownRSS:
-    def __init__(self, pages : list[Page], output_file: str, config_file: str):
-        self.pages = pages
-        self.output_file = Path(output_file)
-        self.config = load_config(Path(config_file))
+class FeedWriter:
+    """Writes RSS/Atom feeds of a site.
 
-    def build(self):
-        fg = FeedGenerator()
+    Each page's entry is rendered once and shared by every feed it belongs
+    to. A feed file is only rewritten when its title, membership or one of
+    its entries changed since it was last written.
+    """
+    def __init__(self, config : dict, language : str):
+        self.config : dict = config
+        self.language : str = language
 
+        self.entries : dict[Path, tuple[Page, FeedEntry, int]] = {}  # markdown file -> page, entry, version
+        self.written : dict[Path, tuple] = {}                         # feed file (relative) -> what it was written with
+        self._version : int = 0
+
+    def entry(self, page : Page, url : str) -> tuple[FeedEntry, int]:
+        cached = self.entries.get(page.file)
+        if cached is not None and cached[0] is page:
+            return cached[1], cached[2]
+
+        entry : FeedEntry = FeedEntry()
+        entry.id(url)
+        entry.link(href=url)
+        entry.title(str(page.get_field("title") or "Untitled"))
+        entry.content(page.render_raw() or "", type="html")
+        page_date = page.get_field("date")
+        if isinstance(page_date, date) and not isinstance(page_date, datetime):
+            page_date = datetime(page_date.year, page_date.month, page_date.day, tzinfo=timezone.utc)
+        entry.pubDate(page_date)
+        entry.updated(page_date)
+
+        self._version += 1
+        self.entries[page.file] = (page, entry, self._version)
+        return entry, self._version
+
+    def write(self, build_path : Path, folder : Path, url : str, title : str, entries : list[tuple[FeedEntry, int]], formats : list[str], previous : Path | None = None) -> list[Path]:
+        """Write the feeds of `folder` (one per format) under `build_path`, return the feed files relative to it.
+
+        Feeds identical to the ones under `previous` (the last build's folder) are hardlinked from it.
+        """
         feed_cfg = self.config["feed"]
         site_cfg = self.config["site"]
+        files : dict[str, Path] = {
+            "rss": folder / Path(feed_cfg["output"]).name,
+            "atom": folder / Path(feed_cfg["atom_output"]).name,
+        }
+
+        outputs : list[Path] = []
+        for fmt in formats:
+            output_path : Path = files[fmt]
+            outputs.append(output_path)
+
+            signature : tuple = (title, tuple(version for _, version in entries))
+            if self.written.get(output_path) == signature and (build_path / output_path).exists():
+                continue
+
+            feed_link : str = f"{url}{output_path.name}"
+            fg = FeedGenerator()
+            fg.id(feed_link)
+            fg.title(title)
+            fg.subtitle(feed_cfg["subtitle"])
+            fg.link(href=site_cfg["base_url"], rel="alternate")
+            fg.link(href=feed_link, rel="self")
+            fg.language(self.language)
+
+            for author in site_cfg["authors"]:
+                fg.author({"name": author["name"], "email": author["email"]})
 
-        fg.id(feed_cfg["output"])
-        fg.title(feed_cfg["title"])
-        fg.subtitle(feed_cfg["subtitle"])
-        fg.link(href=site_cfg["base_url"], rel="alternate")
-        fg.link(href=site_cfg["base_url"] + feed_cfg["output"], rel="self")
-        fg.language(site_cfg["languages"][0] if site_cfg["languages"] else "en")
+            if feed_cfg.get("icon"):
+                fg.logo(feed_cfg["icon"])
 
-        for author in site_cfg["authors"]:
-            fg.author({"name": author["name"], "email": author["email"]})
+            for entry, _ in entries:
+                fg.add_entry(entry, order="append")
 
-        if feed_cfg.get("icon"):
-            fg.logo(feed_cfg["icon"])
+            # dated by the newest entry rather than now, so an unchanged feed stays byte for byte the same
+            updated : list[datetime] = [entry.updated() for entry, _ in entries if entry.updated()]
+            if updated:
+                fg.lastBuildDate(max(updated))
+                fg.updated(max(updated))
 
-        for page in self.pages:
-            entry = fg.add_entry()
-            entry.id(f"{site_cfg['base_url']}/{page.file.stem}")
-            entry.title(str(page.get_field("title") or "Untitled"))
-            entry.link(href=f"{site_cfg['base_url']}/{page.file.stem}")
-            entry.content(page.get_field("content") or "", type="html")
-            page_date = page.get_field("date")
-            if isinstance(page_date, date) and not isinstance(page_date, datetime):
-                page_date = datetime(page_date.year, page_date.month, page_date.day, tzinfo=timezone.utc)
+            (build_path / output_path).parent.mkdir(parents=True, exist_ok=True)
+            xml : bytes = fg.rss_str() if fmt == "rss" else fg.atom_str()
+            write_output(build_path / output_path, xml.decode("utf-8"), previous / output_path if previous else None)
+            self.written[output_path] = signature
 
-            entry.pubDate(page_date)
+        return outputs
 
-        fg.rss_file(str(self.output_file))
\ No newline at end of file
+    def remove_stale(self, build_path : Path, outputs : set[Path], pages : set[Path]):
+        """Delete feeds that are no longer generated and forget entries of removed pages"""
+        for output_path in set(self.written) - outputs:
+            (build_path / output_path).unlink(missing_ok=True)
+            del self.written[output_path]
+        for file in set(self.entries) - pages:
+            del self.entries[file]
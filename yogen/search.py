@@ -0,0 +1,175 @@
+import json
+import html
+import re
+from pathlib import Path
+from yogen.output import write_output, copy_output
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+TERM_PATTERN = re.compile(r"\w+")
+
+class SearchIndex:
+    """Inverted index (term -> page ids) written as shards grouped by term prefix.
+
+    Only the shards touched by an update are rewritten on the next `write`.
+    The index can be saved and loaded back, so that a build only tokenizes
+    the pages changed since the previous one.
+    """
+    def __init__(self, output_path : Path, prefix_length : int = 2, min_term_length : int = 2):
+        self.output_path : Path = output_path
+        self.prefix_length : int = prefix_length
+        self.min_term_length : int = min_term_length
+
+        self.ids : dict[str, int] = {}              # page key -> page id
+        self.documents : dict[int, dict] = {}       # page id -> url, title, section, tags
+        self.page_terms : dict[int, set[str]] = {}  # page id -> terms
+        self.postings : dict[str, set[int]] = {}    # term -> page ids
+        self.shards : dict[str, set[str]] = {}      # prefix -> terms
+        self.stamps : dict[str, list] = {}          # page key -> what it was indexed from (markdown mtime, size and url)
+
+        self.dirty_shards : set[str] = set()
+        self.dirty_documents : bool = True
+        self.loaded_shards : set[str] = set()       # loaded and unchanged, still to be linked from the previous build
+        self.loaded_documents : bool = False
+        self._next_id : int = 0
+
+    def tokenize(self, text : str) -> set[str]:
+        text = html.unescape(TAG_PATTERN.sub(" ", text))
+        return {
+            term for term in TERM_PATTERN.findall(text.lower())
+            if len(term) >= self.min_term_length
+        }
+
+    def shard_of(self, term : str) -> str:
+        return term[:self.prefix_length]
+
+    def update(self, key : str, url : str, title : str, section : str, tags : list[str], text : str):
+        page_id : int | None = self.ids.get(key)
+        if page_id is None:
+            page_id = self._next_id
+            self._next_id += 1
+            self.ids[key] = page_id
+
+        document : dict = {"url": url, "title": title, "section": section, "tags": list(tags)}
+        if self.documents.get(page_id) != document:
+            self.documents[page_id] = document
+            self.dirty_documents = True
+
+        terms : set[str] = self.tokenize(" ".join([title, section, *tags, text]))
+        old_terms : set[str] = self.page_terms.get(page_id, set())
+        self.page_terms[page_id] = terms
+
+        for term in old_terms - terms:
+            self._remove_posting(term, page_id)
+        for term in terms - old_terms:
+            self._add_posting(term, page_id)
+
+    def remove(self, key : str):
+        page_id : int | None = self.ids.pop(key, None)
+        if page_id is None:
+            return
+        for term in self.page_terms.pop(page_id, set()):
+            self._remove_posting(term, page_id)
+        self.documents.pop(page_id, None)
+        self.stamps.pop(key, None)
+        self.dirty_documents = True
+
+    def _add_posting(self, term : str, page_id : int):
+        shard : str = self.shard_of(term)
+        if shard not in self.shards:
+            self.dirty_documents = True     # shard list changed
+        self.postings.setdefault(term, set()).add(page_id)
+        self.shards.setdefault(shard, set()).add(term)
+        self.dirty_shards.add(shard)
+
+    def _remove_posting(self, term : str, page_id : int):
+        shard : str = self.shard_of(term)
+        ids : set[int] = self.postings.get(term, set())
+        ids.discard(page_id)
+        if not ids:
+            self.postings.pop(term, None)
+            self.shards[shard].discard(term)
+            if not self.shards[shard]:
+                del self.shards[shard]
+                self.dirty_documents = True
+        self.dirty_shards.add(shard)
+
+    def write(self, previous : Path | None = None):
+        """Write the dirty shards and the page list, hardlinking unchanged files from `previous` (the last build's index).
+
+        Files of a loaded index that no update touched are linked from `previous` without being serialized.
+        """
+        shards_path : Path = self.output_path / "shards"
+        shards_path.mkdir(parents=True, exist_ok=True)
+
+        for shard in self.dirty_shards | self.loaded_shards:
+            shard_file : Path = shards_path / f"{shard}.json"
+            previous_file : Path | None = previous / "shards" / shard_file.name if previous else None
+            terms : set[str] = self.shards.get(shard, set())
+            if not terms:
+                shard_file.unlink(missing_ok=True)
+                continue
+            if shard not in self.dirty_shards and previous_file is not None and previous_file.is_file():
+                copy_output(previous_file, shard_file, previous_file)
+                continue
+            data = {term: sorted(self.postings[term]) for term in sorted(terms)}
+            write_output(shard_file, json.dumps(data, ensure_ascii=False, separators=(",", ":")), previous_file)
+        self.dirty_shards.clear()
+        self.loaded_shards.clear()
+
+        if self.dirty_documents or self.loaded_documents:
+            index_file : Path = self.output_path / "index.json"
+            previous_file : Path | None = previous / "index.json" if previous else None
+            if not self.dirty_documents and previous_file is not None and previous_file.is_file():
+                copy_output(previous_file, index_file, previous_file)
+            else:
+                data = {
+                    "prefix_length": self.prefix_length,
+                    "min_term_length": self.min_term_length,
+                    "shards": sorted(self.shards),
+                    "documents": {str(i): d for i, d in sorted(self.documents.items())},
+                }
+                write_output(index_file, json.dumps(data, ensure_ascii=False, separators=(",", ":")), previous_file)
+            self.dirty_documents = False
+            self.loaded_documents = False
+
+    def save(self, file : Path):
+        data = {
+            "prefix_length": self.prefix_length,
+            "min_term_length": self.min_term_length,
+            "next_id": self._next_id,
+            "ids": self.ids,
+            "stamps": self.stamps,
+            "documents": {str(i): d for i, d in self.documents.items()},
+            "terms": {str(i): sorted(terms) for i, terms in self.page_terms.items()},
+        }
+        file.parent.mkdir(parents=True, exist_ok=True)
+        write_output(file, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+
+    def load(self, file : Path) -> bool:
+        """Restore a saved index, whose files are expected in the previous build unchanged"""
+        try:
+            data = json.loads(file.read_text(encoding="utf-8"))
+            if (data["prefix_length"], data["min_term_length"]) != (self.prefix_length, self.min_term_length):
+                return False
+            next_id : int = data["next_id"]
+            ids : dict[str, int] = data["ids"]
+            stamps : dict[str, list] = data["stamps"]
+            documents : dict[int, dict] = {int(i): d for i, d in data["documents"].items()}
+            page_terms : dict[int, set[str]] = {int(i): set(terms) for i, terms in data["terms"].items()}
+        except (OSError, ValueError, KeyError):
+            return False    # missing, stale or corrupt cache, index everything
+
+        self._next_id, self.ids, self.stamps = next_id, ids, stamps
+        self.documents, self.page_terms = documents, page_terms
+
+        self.postings.clear()
+        self.shards.clear()
+        for page_id, terms in self.page_terms.items():
+            for term in terms:
+                self.postings.setdefault(term, set()).add(page_id)
+                self.shards.setdefault(self.shard_of(term), set()).add(term)
+        self.dirty_shards.clear()
+        self.dirty_documents = False
+        self.loaded_shards = set(self.shards)
+        self.loaded_documents = True
+        return True
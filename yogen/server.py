@@ -0,0 +1,228 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+from http.server import SimpleHTTPRequestHandler
+from yogen.website import Site
+from yogen.page import Page
+from yogen.metrics import COUNT_BUCKETS, Metrics
+
+STATUS_PATH = "/_yogen/status"
+
+class RenderQueue:
+    """Converts the pages of a site on demand for `yogen serve`.
+
+    Requested pages are converted synchronously on first hit, a background
+    thread backfills the rest. Pages changed on disk are queued again, the
+    ones most recently requested by the browser first.
+    """
+    def __init__(self, site : Site):
+        self.site : Site = site
+        self.metrics : Metrics = site.metrics
+        # index_lock guards the loaded pages and the index files, lock the queue and page
+        # rendering. Indexes are written without `lock`, so requests are not kept waiting.
+        # When both are needed, index_lock is taken first.
+        self.index_lock : threading.Lock = threading.Lock()
+        self.lock : threading.RLock = threading.RLock()
+        self.wakeup : threading.Condition = threading.Condition(self.lock)
+
+        self.urls : dict[str, Path] = {}                # url -> markdown file
+        self.rendered : set[Path] = set()
+        self.viewed : dict[str, float] = {}             # url -> time of the last request
+        self.changed : dict[Site, list[Page]] = {}      # pages converted again since the last index update
+        self.waiting : dict[Path, float] = {}           # changed file -> time of the event that changed it
+        self.indexed : bool = False                     # feed, search and sitemap written
+        self.index_error : str | None = None            # last index update failed, retried on the next change
+        self.index_started : float = 0.0               # time the content was last indexed
+        self.changed_since : float | None = None        # time of the first event behind `changed`
+
+        self._heap : list[tuple] = []
+        self._counter = itertools.count()
+        self._thread : threading.Thread | None = None
+
+    def start(self):
+        with self.index_lock, self.lock:
+            self._index()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _index(self):
+        self.index_started = time.monotonic()
+        self.site.index_content()
+        self.urls.clear()
+        self.rendered.clear()
+        self.changed.clear()
+        self.changed_since = None
+        self.indexed = False
+        self.index_error = None
+        self._heap.clear()
+
+        for site in self.site.language_sites():
+            for file in sorted(site.pages):
+                self.urls[site.page_url(site.pages[file])] = file
+                self._push(file)
+
+    def _push(self, file : Path, url : str | None = None):
+        last_view : float | None = self.viewed.get(url) if url else None
+        if last_view is not None:
+            priority = (0, -last_view)              # most recently viewed first
+        else:
+            priority = (1, next(self._counter))
+        heapq.heappush(self._heap, (priority, file))
+        self.metrics.set_gauge("queue.depth", len(self._heap))
+        self.wakeup.notify()
+
+    def _render(self, file : Path) -> bool:
+        site : Site | None = self.site.site_for(file)
+        if file in self.rendered or site is None or file not in site.pages:
+            return False
+        site.convert_page(file, site.pages[file])
+        self.rendered.add(file)
+
+        since : float | None = self.waiting.pop(file, None)
+        if since is not None:
+            self.metrics.observe("serve.event_to_output_seconds", time.monotonic() - since)
+        return True
+
+    def request(self, path : str):
+        url : str = unquote(urlsplit(path).path)
+        if url.endswith("/index.html"):
+            url = url[:-len("index.html")]
+        elif not url.endswith("/") and not Path(url).suffix:
+            url += "/"
+
+        file : Path | None = self.urls.get(url)
+        if file is None:
+            return                  # static file, nothing to render
+        self.viewed[url] = time.monotonic()
+        if file in self.rendered:
+            return
+        with self.lock:
+            self._render(file)
+
+    def rebuild_md(self, md_files : set[Path], since : float | None = None):
+        since = since or time.monotonic()
+        with self.index_lock, self.lock:
+            self.site.load_templates()
+            urls : dict[Path, str] = {file: url for url, file in self.urls.items()}
+            for file in md_files:
+                site : Site | None = self.site.site_for(file)
+                if site is None:
+                    continue
+                self.rendered.discard(file)
+                if not file.exists():
+                    site.remove_page(file)
+                    self.urls.pop(urls.get(file), None)
+                    self.changed.setdefault(site, [])
+                    continue
+                page : Page = site.load_page(file)      # metadata only, converted when popped
+                self.urls[site.page_url(page)] = file
+                self.waiting[file] = since
+                self.changed.setdefault(site, []).append(page)
+                self._push(file, urls.get(file))
+            if self.changed_since is None or since < self.changed_since:
+                self.changed_since = since
+            self.index_error = None
+            self.wakeup.notify()        # deleted pages queue nothing but the index update
+
+    def rebuild_all(self):
+        with self.index_lock, self.lock:
+            self._index()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self._heap and (self.index_error or (self.indexed and not self.changed)):
+                    self.wakeup.wait()
+
+                if self._heap:
+                    _, file = heapq.heappop(self._heap)
+                    self.metrics.set_gauge("queue.depth", len(self._heap))
+                    try:
+                        self._render(file)
+                    except Exception as e:
+                        print(f"Failed to build {file}: {e}")
+                    continue
+
+            # queue drained: bring feed, search and sitemap up to date
+            with self.index_lock:
+                with self.lock:
+                    if self._heap:
+                        continue    # pages changed meanwhile, render them first
+                    indexed : bool = self.indexed
+                    changed : dict[Site, list[Page]] = self.changed
+                    since : float | None = self.changed_since
+                    self.changed = {}
+                    self.changed_since = None
+
+                start : float = time.monotonic()
+                try:
+                    if not indexed:
+                        for site in self.site.language_sites():
+                            site.convert_indexes()
+                        self.site.convert_sitemap_index()
+                        self._log_rebuild("all", len(self.urls), start, self.index_started)
+                        print("All pages built")
+                    else:
+                        for site, pages in changed.items():
+                            site.update_indexes(pages)
+                        self.site.convert_sitemap_index()
+                        self._log_rebuild("md", sum(len(p) for p in changed.values()), start, since)
+                except Exception as e:
+                    print(f"Failed to update feed, search and sitemap: {e}")
+                    with self.lock:
+                        # keep the pages for the next attempt, made on the next change
+                        for site, pages in changed.items():
+                            self.changed.setdefault(site, [])[:0] = pages
+                        if since is not None and (self.changed_since is None or since < self.changed_since):
+                            self.changed_since = since
+                        self.index_error = str(e)
+                    continue
+
+                with self.lock:
+                    self.indexed = True
+
+    def _log_rebuild(self, kind : str, pages : int, index_start : float, since : float | None):
+        """Record a rebuild once its pages are written and the indexes updated"""
+        end : float = time.monotonic()
+        since = since or index_start
+        self.metrics.observe("rebuild.pages", pages, COUNT_BUCKETS)
+        self.metrics.observe("rebuild.index_seconds", end - index_start)
+        self.metrics.observe("rebuild.event_to_output_seconds", end - since)
+        self.metrics.log("rebuild", kind=kind, pages=pages, index_seconds=end - index_start, latency=end - since)
+
+    def status(self) -> dict:
+        queue : dict = {
+            "depth": len(self._heap),
+            "rendered": len(self.rendered),
+            "pages": len(self.urls),
+            "indexed": self.indexed,
+            "error": self.index_error,
+        }
+        return {"queue": queue, **self.metrics.snapshot()}
+
+
+class PreviewHandler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, queue : RenderQueue, **kwargs):
+        self.queue : RenderQueue = queue
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if self.path == STATUS_PATH:
+            body : bytes = json.dumps(self.queue.status(), indent=2).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.queue.request(self.path)
+        super().do_GET()
+
+    def do_HEAD(self):
+        self.queue.request(self.path)
+        super().do_HEAD()
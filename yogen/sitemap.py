@@ -0,0 +1,146 @@
+from pathlib import Path
+from datetime import date
+from xml.etree import ElementTree
+from xml.sax.saxutils import XMLGenerator
+from yogen.output import open_output
+
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+MAX_URLS = 50000    # sitemap protocol limit per file
+
+class Sitemap:
+    """sitemap.xml writer, split into chunks plus a sitemap index past `max_urls`.
+
+    Files are streamed out entry by entry. A url keeps its chunk once it has
+    one (new urls fill free slots), so a chunk is only rewritten when one of
+    its own urls or lastmod dates changed since the last `write`.
+    """
+    def __init__(self, output_path : Path, base_url : str, output : str = "sitemap.xml", max_urls : int = MAX_URLS, prefix : str = "/"):
+        self.output_path : Path = output_path
+        self.base_url : str = base_url.rstrip("/")
+        self.output : str = output
+        self.max_urls : int = max_urls
+        self.prefix : str = prefix                      # url path of output_path
+
+        self.entries : dict[str, date] = {}             # url -> lastmod
+        self.chunk_of : dict[str, int] = {}             # url -> chunk number, from 1
+        self.written : dict[str, tuple] = {}            # file name -> entries it was last written with
+        self.urlsets : tuple = ()                       # (url, lastmod) of the url files, for a sitemap index
+
+    def update(self, url : str, lastmod : date):
+        self.entries[url] = lastmod
+
+    def remove(self, url : str):
+        self.entries.pop(url, None)
+
+    def restore(self, path : Path):
+        """Take the chunk of every url from the sitemap files previously written to `path`"""
+        stem : str = Path(self.output).stem
+        chunks : list[tuple[int, Path]] = [
+            (int(file.stem[len(stem) + 1:]), file) for file in path.glob(f"{stem}-*.xml")
+            if file.stem[len(stem) + 1:].isdigit()
+        ]
+        if not chunks and (path / self.output).is_file():
+            chunks = [(1, path / self.output)]
+
+        self.chunk_of.clear()
+        for chunk, file in chunks:
+            try:
+                for _, element in ElementTree.iterparse(file):
+                    if element.tag == f"{{{SITEMAP_NS}}}loc" and (element.text or "").startswith(self.base_url):
+                        self.chunk_of[element.text[len(self.base_url):]] = chunk
+            except ElementTree.ParseError:
+                pass    # chunks are reassigned, rewritten as needed
+
+    def _assign_chunks(self):
+        for url in [url for url in self.chunk_of if url not in self.entries]:
+            del self.chunk_of[url]
+        if len(self.entries) <= self.max_urls and len(set(self.chunk_of.values())) > 1:
+            self.chunk_of.clear()       # fits in a single file again
+
+        sizes : dict[int, int] = {}
+        for chunk in self.chunk_of.values():
+            sizes[chunk] = sizes.get(chunk, 0) + 1
+
+        chunk : int = 1
+        for url in sorted(self.entries):
+            if url in self.chunk_of:
+                continue
+            while sizes.get(chunk, 0) >= self.max_urls:
+                chunk += 1
+            self.chunk_of[url] = chunk
+            sizes[chunk] = sizes.get(chunk, 0) + 1
+
+    def write(self, previous : Path | None = None):
+        """Write the changed files, hardlinking the ones identical to `previous` (the last build's folder)"""
+        self.output_path.mkdir(parents=True, exist_ok=True)
+
+        self._assign_chunks()
+        chunks : dict[int, list[str]] = {}
+        for url in sorted(self.entries):
+            chunks.setdefault(self.chunk_of[url], []).append(url)
+
+        files : dict[str, tuple] = {}
+        if len(chunks) <= 1:
+            urls : list[str] = next(iter(chunks.values()), [])
+            files[self.output] = tuple((url, self.entries[url]) for url in urls)
+        else:
+            stem : str = Path(self.output).stem
+            for i, chunk in sorted(chunks.items()):
+                files[f"{stem}-{i}.xml"] = tuple((url, self.entries[url]) for url in chunk)
+
+        for name, entries in files.items():
+            if self.written.get(name) == entries and (self.output_path / name).exists():
+                continue
+            self._write_urlset(self.output_path / name, entries, previous / name if previous else None)
+            self.written[name] = entries
+
+        self.urlsets = tuple(
+            (f"{self.prefix}{name}", max(lastmod for _, lastmod in entries))
+            for name, entries in files.items() if entries
+        )
+        if len(chunks) > 1:
+            self.write_index(self.urlsets, previous)
+
+        # drop chunks left over from a bigger site
+        for name in list(self.written):
+            if name not in files and name != self.output:
+                (self.output_path / name).unlink(missing_ok=True)
+                del self.written[name]
+
+    def _write_urlset(self, file : Path, entries : tuple, previous : Path | None = None):
+        with open_output(file, previous=previous) as f:
+            xml = XMLGenerator(f, encoding="utf-8", short_empty_elements=True)
+            xml.startDocument()
+            xml.startElement("urlset", {"xmlns": SITEMAP_NS})
+            for url, lastmod in entries:
+                xml.startElement("url", {})
+                self._text_element(xml, "loc", f"{self.base_url}{url}")
+                self._text_element(xml, "lastmod", lastmod.isoformat())
+                xml.endElement("url")
+            xml.endElement("urlset")
+            xml.endDocument()
+
+    def write_index(self, index : tuple, previous : Path | None = None):
+        """Write `output` as a sitemap index of (url, lastmod) sitemap files, if it changed"""
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        if self.written.get(self.output) != index or not (self.output_path / self.output).exists():
+            self._write_index(self.output_path / self.output, index, previous / self.output if previous else None)
+            self.written[self.output] = index
+
+    def _write_index(self, file : Path, index : tuple, previous : Path | None = None):
+        with open_output(file, previous=previous) as f:
+            xml = XMLGenerator(f, encoding="utf-8", short_empty_elements=True)
+            xml.startDocument()
+            xml.startElement("sitemapindex", {"xmlns": SITEMAP_NS})
+            for url, lastmod in index:
+                xml.startElement("sitemap", {})
+                self._text_element(xml, "loc", f"{self.base_url}{url}")
+                self._text_element(xml, "lastmod", lastmod.isoformat())
+                xml.endElement("sitemap")
+            xml.endElement("sitemapindex")
+            xml.endDocument()
+
+    def _text_element(self, xml : XMLGenerator, name : str, text : str):
+        xml.startElement(name, {})
+        xml.characters(text)
+        xml.endElement(name)
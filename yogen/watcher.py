@@ -1,22 +1,33 @@
 import threading
+import time
 from pathlib import Path
+from yogen.metrics import COUNT_BUCKETS, Metrics
 from watchdog.events import FileSystemEvent, FileSystemEventHandler
 
 class WatchDogHandler(FileSystemEventHandler):
-    def __init__(self, delay : float = 0.3):
+    def __init__(self, delay : float = 0.3, metrics : Metrics | None = None):
         super().__init__()
         self.delay = delay
+        self.metrics : Metrics | None = metrics
         self._timer : threading.Timer | None = None
+        self._lock : threading.Lock = threading.Lock()     # guards the current batch
+
+        # current batch of events, coalesced by the timer
+        self.events : int = 0
+        self.batch_started : float | None = None
 
         self.rebuild_all : bool = False
         self.rebuild_md : set[str] = set()
 
         # signals
         self.on_rebuild_all : callable[[], None] | None = None
-        self.on_rebuild_md : callable[[set[Path]], None] | None = None
+        self.on_rebuild_md : callable[[set[Path], float], None] | None = None     # files, time of the first event
         
         
     def _arm_timer(self):
+        self.events += 1
+        if self.batch_started is None:
+            self.batch_started = time.monotonic()
         if self._timer:
             self._timer.cancel()
         self._timer = threading.Timer(self.delay, self.on_timeout)
@@ -30,11 +41,12 @@ class WatchDogHandler(FileSystemEventHandler):
         file_path : Path = Path(event.src_path)
         print("Modified file:", file_path)
         try:
-            if file_path.suffix != ".md":
-                self.rebuild_all = True
-            else:
-                self.rebuild_md.add(file_path)
-            self._arm_timer()
+            with self._lock:
+                if file_path.suffix != ".md":
+                    self.rebuild_all = True
+                else:
+                    self.rebuild_md.add(file_path)
+                self._arm_timer()
         except FileNotFoundError:
             return
     
@@ -42,19 +54,25 @@ class WatchDogHandler(FileSystemEventHandler):
         file_path : Path = Path(event.src_path)
         print("Created file:", file_path)
         try:
-            self.rebuild_all = True
-            self._arm_timer()
+            with self._lock:
+                if event.is_directory or file_path.suffix != ".md":
+                    self.rebuild_all = True
+                else:
+                    self.rebuild_md.add(file_path)
+                self._arm_timer()
         except FileNotFoundError:
             return
     
-    # TODO: not rebuild when creating or deleting markdown file
-    
     def on_deleted(self, event: FileSystemEvent) -> None:
         file_path : Path = Path(event.src_path)
         print("Deleted file:", file_path)
         try:
-            self.rebuild_all = True
-            self._arm_timer()
+            with self._lock:
+                if event.is_directory or file_path.suffix != ".md":
+                    self.rebuild_all = True
+                else:
+                    self.rebuild_md.add(file_path)
+                self._arm_timer()
         except FileNotFoundError:
             return
     
@@ -62,19 +80,43 @@ class WatchDogHandler(FileSystemEventHandler):
         file_path : Path = Path(event.src_path)
         print("Moved file:", file_path)
         try:
-            self.rebuild_all = True
-            self._arm_timer()
+            with self._lock:
+                self.rebuild_all = True
+                self._arm_timer()
         except FileNotFoundError:
             return
     
     def on_timeout(self):
-        if self.rebuild_all and self.on_rebuild_all:
+        # take the batch first: events arriving during the callback start the next one
+        with self._lock:
+            events, batch_started = self.events, self.batch_started
+            rebuild_all, rebuild_md = self.rebuild_all, self.rebuild_md
+            self.events = 0
+            self.batch_started = None
+            self.rebuild_all = False
+            self.rebuild_md = set()
+            if self._timer is threading.current_thread():
+                self._timer = None
+
+        start : float = time.monotonic()
+        kind : str | None = None
+        if rebuild_all and self.on_rebuild_all:
             print("REBUILDING ALL...")
+            kind = "all"
             self.on_rebuild_all()
-        elif self.rebuild_md and self.on_rebuild_md:
+        elif rebuild_md and self.on_rebuild_md:
             print("REBUILDING MD...")
-            self.on_rebuild_md(self.rebuild_md)
+            kind = "md"
+            self.on_rebuild_md(rebuild_md, batch_started)
 
-        self.rebuild_all = False
-        self.rebuild_md.clear()
-        self._timer = None
\ No newline at end of file
+        if self.metrics and kind:
+            end : float = time.monotonic()
+            self.metrics.increment(f"watcher.rebuild_{kind}")
+            self.metrics.observe("watcher.events_per_rebuild", events, COUNT_BUCKETS)
+            # only the callback: the rebuild itself is measured by whoever does it
+            self.metrics.observe("watcher.callback_seconds", end - start)
+            self.metrics.observe("watcher.event_to_callback_seconds", end - batch_started)
+            self.metrics.log(
+                "watcher", kind=kind, events=events, files=len(rebuild_md),
+                seconds=end - start, latency=end - batch_started,
+            )
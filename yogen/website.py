@@ -1,37 +1,106 @@
+import os
+import json
+import hashlib
+import re
 import shutil
 import subprocess
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from yogen.config import load_config
 from yogen.page import Page
-from feedgen.feed import FeedGenerator
-from datetime import datetime, date, timezone
+from yogen.search import SearchIndex
+from yogen.sitemap import Sitemap
+from yogen.checker import LinkChecker
+from yogen.output import publish, rollback, write_output, copy_output
+from yogen.metrics import Metrics, timed
+from yogen.rss import FeedWriter
 from pathlib import Path
+from typing import Callable
+
+def slugify(name : str) -> str:
+    return re.sub(r"[^\w-]+", "-", name.strip().lower()).strip("-")
+
+
+def _build_content(site : "Site") -> dict:
+    # runs in a worker process: only what the parent still needs is sent back,
+    # not the pages and their converted html
+    site.build_content()
+    return {
+        "language": site.language,
+        "metrics": site.metrics,
+        "urlsets": site.sitemap.urlsets,
+        "pages": sorted(site.pages),
+    }
+
 
 class Site():
-    def __init__(self, config_path : Path):
+    def __init__(self, config_path : Path, language : str | None = None, config : dict | None = None):
         self.config_file : Path = config_path
-        self.config = load_config(config_path)
+        self.config = config if config is not None else load_config(config_path)
+        self.metrics : Metrics = Metrics()
         self.pages : dict[Path, Page] = {}
         self.templates : dict[str, str] = {}    # template name -> template content
         self.sections : dict[str, set[Page]] = {}
         self.tags : dict[str, set[Page]] = {}
         self.page_sections : dict[Page, str] = {}
         self.page_tags : dict[Page, set[str]] = {}
+        self.page_files : list[Path] = []       # pages built by a worker process, see `build_languages`
 
         # helper paths
-        self.build_path : Path = Path(self.config['paths']['build'])
+        self.build_root : Path = Path(self.config['paths']['build'])      # the live build folder
+        self.build_path : Path = self.build_root                            # where this site writes to
+        self.link_root : Path | None = None     # output of the previous build, unchanged files are hardlinked from it
         self.content_path : Path = Path(self.config['paths']['content'])
         self.templates_path : Path = Path(self.config['paths']['templates'])
         self.static_path : Path = Path(self.config['paths']['static'])
-
-
-    def index_page(self, page : Page):
+        self.cache_path : Path = Path(self.config['paths']['cache'])
+
+        # languages: with more than one, each language has its own content tree
+        # (content/<lang>/) built into build/<lang>/, the first one into build/
+        self.languages : list[str] = self.config["site"]["languages"] or ["en"]
+        self.language : str = language or self.languages[0]
+        self.url_prefix : str = "/"
+        self.sitemap_output : str = "sitemap.xml"
+        self.translations : dict[str, Site] = {}    # language -> site
+
+        if language is not None:
+            self.content_path = self.content_path / language
+            if language != self.languages[0]:
+                self.build_path = self.build_path / language
+                self.url_prefix = f"/{language}/"
+            else:
+                # build/sitemap.xml is the index of every language's sitemap
+                self.sitemap_output = f"sitemap-{language}.xml"
+        elif len(self.languages) > 1:
+            for lang in self.languages:
+                translation : Site = Site(config_path, lang, self.config)
+                translation.templates = self.templates     # parsed once, shared by every language
+                translation.metrics = self.metrics
+                self.translations[lang] = translation
+
+        search_cfg = self.config["search"]
+        self.search : SearchIndex = SearchIndex(self.build_path / search_cfg["output"], search_cfg["prefix_length"])
+        self.sitemap : Sitemap = Sitemap(self.build_path, self.config["site"]["base_url"], self.sitemap_output, prefix=self.url_prefix)
+        self.feeds : FeedWriter = FeedWriter(self.config, self.language)
+
+
+    def unindex_page(self, page : Page):
         old_section : str = self.page_sections.pop(page, None)
         if old_section is not None:
             self.sections[old_section].discard(page)
+            if not self.sections[old_section]:
+                del self.sections[old_section]
 
         old_tags : set[str] = self.page_tags.pop(page, set())
         for tag in old_tags:
             self.tags[tag].discard(page)
+            if not self.tags[tag]:
+                del self.tags[tag]
+
+
+    def index_page(self, page : Page):
+        self.unindex_page(page)
 
         new_tags : set[str] = set()
         if page.has_field("tags"):
@@ -45,8 +114,15 @@ class Site():
             self.sections.setdefault(section, set()).add(page)
             self.page_sections[page] = section
 
+
+    def page_url(self, page : Page) -> str:
+        page_path : Path = page.file.relative_to(self.content_path).parent
+        if page_path == Path("."):
+            return self.url_prefix
+        return f"{self.url_prefix}{page_path.as_posix()}/"
+
     
-    def load_pages(self):
+    def clear_pages(self):
         self.pages.clear()
         self.sections.clear()
         self.tags.clear()
@@ -54,108 +130,209 @@ class Site():
         self.page_sections.clear()
         self.page_tags.clear()
 
+
+    @timed("load_pages")
+    def load_pages(self, select : Callable[[Path], bool] | None = None):
+        self.clear_pages()
+
         for item in self.content_path.rglob("*"):
-            if item.suffix == ".md":
-                page : Page = Page(item, self.config_file, self.content_path)
+            if item.suffix == ".md" and (select is None or select(item)):
+                page : Page = Page(item, self.config, self.content_path)
                 self.pages[item] = page
-        
+
         # TODO: handle sections and tags
         # TODO: test
         for page in self.pages.values():
             self.index_page(page)
     
 
+    @timed("convert_feed")
     def convert_feed(self):
-        feed_cfg = self.config.get("feed", {})
-        target_sections = set(feed_cfg.get("sections", []))
-        target_tags = set(feed_cfg.get("tags", []))
+        """Write the configured feed plus one feed per section and per tag, if enabled"""
+        feed_cfg = self.config["feed"]
+        target_sections = set(feed_cfg["sections"])
+        target_tags = set(feed_cfg["tags"])
+        base_url : str = self.config["site"]["base_url"].rstrip("/")
+
+        feeds : dict[Path, tuple[str, list[Page]]] = {}     # feed folder -> title, pages
+
+        def add_feed(folder : Path, title : str, pages : list[Page]):
+            if folder in feeds:
+                raise RuntimeError(
+                    f"Output path collision: {self.build_path / folder} "
+                    f"(feeds '{feeds[folder][0]}' and '{title}' share a folder)"
+                )
+            feeds[folder] = (title, pages)
+
+        if target_sections or target_tags:
+            add_feed(Path(feed_cfg["output"]).parent, feed_cfg["title"], [
+                page for page in self.pages.values()
+                if (target_sections and self.page_sections.get(page) in target_sections)
+                or (target_tags and self.page_tags.get(page, set()) & target_tags)
+            ])
+        if feed_cfg["section_feeds"]:
+            for section, pages in self.sections.items():
+                if slugify(section):
+                    add_feed(Path(slugify(section)), f"{feed_cfg['title']} - {section}", list(pages))
+        if feed_cfg["tag_feeds"]:
+            for tag, pages in self.tags.items():
+                if slugify(tag):
+                    add_feed(Path("tags") / slugify(tag), f"{feed_cfg['title']} - {tag}", list(pages))
+
+        names : list[str] = [Path(feed_cfg["output" if fmt == "rss" else "atom_output"]).name for fmt in feed_cfg["formats"]]
+        for folder in feeds:
+            for name in names:
+                if (self.content_path / folder / name).exists():
+                    raise RuntimeError(
+                        f"Output path collision: {self.build_path / folder / name} "
+                        f"(raw file conflicts with generated feed)"
+                    )
+
+        outputs : set[Path] = set()
+        for folder, (title, pages) in feeds.items():
+            pages.sort(key=lambda p: (p.get_field("date"), p.file), reverse=True)     # newest first
+            entries = [self.feeds.entry(page, f"{base_url}{self.page_url(page)}") for page in pages]
+            folder_url : str = "" if folder == Path(".") else f"{folder.as_posix()}/"
+            url : str = f"{base_url}{self.url_prefix}{folder_url}"
+            outputs.update(self.feeds.write(
+                self.build_path, folder, url, title, entries, feed_cfg["formats"], self.previous_output(self.build_path)
+            ))
+
+        self.feeds.remove_stale(self.build_path, outputs, set(self.pages))
+
+
+    def index_search(self, page : Page):
+        self.search.update(
+            page.file.relative_to(self.content_path).as_posix(),
+            self.page_url(page),
+            str(page.get_field("title") or ""),
+            str(page.get_field("section") or ""),
+            [str(t) for t in page.get_field("tags") or [] if t],
+            page.render_raw() or "",
+        )
+
 
-        if not feed_cfg or (not target_sections and not target_tags):
+    @timed("convert_search")
+    def convert_search(self):
+        if not self.config["search"]["enabled"]:
             return
 
-        pages_for_feed = [
-            page for page in self.pages.values()
-            if (target_sections and self.page_sections.get(page) in target_sections)
-            or (target_tags and self.page_tags.get(page, set()) & target_tags)
-        ]
+        search_cfg = self.config["search"]
+        self.search = SearchIndex(self.build_path / search_cfg["output"], search_cfg["prefix_length"])
+        previous : Path | None = self.previous_output(self.search.output_path)
+        if previous is not None:
+            self.search.load(self.search_cache)    # the index of the previous build, see `commit_caches`
+
+        keys : set[str] = set()
+        for file in sorted(self.pages):     # stable page ids across builds
+            page : Page = self.pages[file]
+            key : str = file.relative_to(self.content_path).as_posix()
+            keys.add(key)
+            try:
+                stat = file.stat()
+                stamp : list | None = [stat.st_mtime_ns, stat.st_size, self.page_url(page)]
+            except OSError:
+                stamp = None    # merged from a shard built elsewhere
+            if stamp is None or self.search.stamps.get(key) != stamp:
+                self.index_search(page)
+                if stamp is not None:
+                    self.search.stamps[key] = stamp
+        for key in set(self.search.ids) - keys:
+            self.search.remove(key)
+
+        self.search.write(previous)
+        self.search.save(self.search_cache.with_suffix(".pending"))
+
+
+    @property
+    def search_cache(self) -> Path:
+        return self.cache_path / f"search-{self.language}.json"
+
+
+    def commit_caches(self):
+        """Keep the caches written by a build once it is published, they describe the live build folder"""
+        for site in self.language_sites():
+            pending : Path = site.search_cache.with_suffix(".pending")
+            if pending.exists():
+                os.replace(pending, site.search_cache)
+
+
+    def discard_caches(self, pending : bool = False):
+        for site in self.language_sites():
+            (site.search_cache.with_suffix(".pending") if pending else site.search_cache).unlink(missing_ok=True)
+
+
+    @timed("convert_sitemap")
+    def convert_sitemap(self):
+        self.sitemap = Sitemap(self.build_path, self.config["site"]["base_url"], self.sitemap_output, prefix=self.url_prefix)
+        previous : Path | None = self.previous_output(self.build_path)
+        if previous is not None and previous.is_dir():
+            self.sitemap.restore(previous)     # urls keep the chunk they had in the previous build
+        for page in self.pages.values():
+            self.sitemap.update(self.page_url(page), page.lastmod())
+        self.sitemap.write(previous)
 
-        # print("pages:", [str(page.file) for page in pages_for_feed])
 
-        output_path : Path = self.build_path / feed_cfg["output"]
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+    def convert_sitemap_index(self):
+        """With several languages, write build/sitemap.xml as an index of every language's sitemap"""
+        if not self.translations:
+            return
+        self.sitemap.write_index(tuple(
+            urlset for translation in self.translations.values() for urlset in translation.sitemap.urlsets
+        ), self.previous_output(self.build_path))
 
-        # print("output path:", output_path)
-
-        fg = FeedGenerator()
-
-        site_cfg = self.config["site"]
-
-        base_url = site_cfg["base_url"]
-        feed_link = f"{site_cfg["base_url"]}/{feed_cfg['output'].lstrip('/')}"
-        fg.id(feed_cfg["output"])
-        fg.title(feed_cfg["title"])
-        fg.subtitle(feed_cfg["subtitle"])
-        fg.link(href=base_url, rel="alternate")
-        fg.link(href=feed_link, rel="self")
-        # print("link:", base_url)
-        # print("feed_link:", feed_link)
-        fg.language(site_cfg["languages"][0] if site_cfg["languages"] else "en")    # take first language, defaults to english
-
-        for author in site_cfg["authors"]:
-            # print("author:", author["name"])
-            # print("email:", author["email"])
-            fg.author({"name": author["name"], "email": author["email"]})
-
-        if feed_cfg.get("icon"):
-            fg.logo(feed_cfg["icon"])
-
-        # print("\nPAGES\n")
-        for page in pages_for_feed:
-            page_path : Path = page.file.relative_to(self.content_path)
-            url : str = f"{base_url.rstrip("/")}/{str(page_path.parent)}/"
-            entry = fg.add_entry()
-            entry.id(url)
-            entry.link(href=url)
-            entry.title(str(page.get_field("title") or "Untitled"))
-            entry.content(page.render_raw() or "", type="html")
-            page_date = page.get_field("date")
-            if isinstance(page_date, date) and not isinstance(page_date, datetime):
-                page_date = datetime(page_date.year, page_date.month, page_date.day, tzinfo=timezone.utc)
-            entry.pubDate(page_date)
-
-        fg.rss_file(str(output_path))
 
-    def convert_page(self, file : Path, page : Page):
-        target: Path = self.build_path / file.relative_to(self.content_path)
-        target.parent.mkdir(parents=True, exist_ok=True)
+    def set_build_root(self, root : Path, link_root : Path | None = None):
+        self.build_path = root / self.build_path.relative_to(self.build_root)
+        self.build_root = root
+        self.link_root = link_root
+        self.search.output_path = self.build_path / self.config["search"]["output"]
+        self.sitemap.output_path = self.build_path
 
-        output_path: Path = target.parent / "index.html"
-        output_path.write_text(
-            page.render(self.templates),
-            encoding="utf-8",
-        )
+        for translation in self.translations.values():
+            translation.set_build_root(root, link_root)
+
+
+    def previous_output(self, target : Path) -> Path | None:
+        if self.link_root is None:
+            return None
+        return self.link_root / target.relative_to(self.build_root)
+
+
+    def page_output(self, file : Path) -> Path:
+        return (self.build_path / file.relative_to(self.content_path)).parent / "index.html"
+
+
+    def convert_page(self, file : Path, page : Page):
+        start : float = time.perf_counter()
+        output_path: Path = self.page_output(file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        write_output(output_path, page.render(self.templates), self.previous_output(output_path))
+        self.metrics.observe_page(file, time.perf_counter() - start)
     
 
+    @timed("convert_pages")
     def convert_pages(self):    # should it be convert_loaded_pages()?
-        self.load_templates()
-
         for file, page in self.pages.items():
             self.convert_page(file, page)
 
 
-    def copy_other_files(self):
+    @timed("copy_other_files")
+    def copy_other_files(self, select : Callable[[Path], bool] | None = None):
+        page_outputs : set[Path] = {self.page_output(file) for file in self.pages}
+
         for item in self.content_path.rglob("*"):
-            if item.is_file() and item.suffix != ".md":
+            if item.is_file() and item.suffix != ".md" and (select is None or select(item)):
                 target = self.build_path / item.relative_to(self.content_path)
                 target.parent.mkdir(parents=True, exist_ok=True)
 
-                if target.exists():
+                if target.exists() or target in page_outputs:
                     raise RuntimeError(
                         f"Output path collision: {target} "
                         f"(raw file conflicts with markdown-generated page)"
                     )
 
-                shutil.copy2(item, target)
+                copy_output(item, target, self.previous_output(target))
     
 
     def load_templates(self):
@@ -164,27 +341,281 @@ class Site():
             self.templates[name] = file.read_text(encoding="utf-8")
     
 
-    def rebuild_md(self, md_files: set[Path]):
+    def load_page(self, file : Path) -> Page:
+        page : Page = Page(file, self.config, self.content_path)
+        self.pages[file] = page
+        self.index_page(page)
+        return page
+
+
+    def remove_page(self, file : Path):
+        """Forget a deleted page and delete its html, the next `update_indexes` drops it from feed, search and sitemap"""
+        page : Page | None = self.pages.pop(file, None)
+        if page is None:
+            return
+        self.unindex_page(page)
+        self.sitemap.remove(self.page_url(page))
+        self.search.remove(file.relative_to(self.content_path).as_posix())
+        self.page_output(file).unlink(missing_ok=True)
+
+
+    def update_indexes(self, pages : list[Page]):
+        self.convert_feed()     # only feeds with changed entries or membership are written
+        for page in pages:
+            self.sitemap.update(self.page_url(page), page.lastmod())
+            if self.config["search"]["enabled"]:
+                self.index_search(page)
+
+        self.sitemap.write()
+        if self.config["search"]["enabled"]:
+            self.search.write()
+
+
+    def language_sites(self) -> list["Site"]:
+        return list(self.translations.values()) or [self]
+
+
+    def check_languages(self):
+        """With several languages, fail on content that no language would build"""
+        if not self.translations:
+            return
+        for translation in self.translations.values():
+            if not translation.content_path.is_dir():
+                raise FileNotFoundError(
+                    f"Missing content folder for language '{translation.language}': {translation.content_path}"
+                )
+        for item in self.content_path.iterdir():
+            if not item.name.startswith(".") and (not item.is_dir() or item.name not in self.translations):
+                raise RuntimeError(
+                    f"Content outside of every language folder: {item} "
+                    f"(expected in {self.content_path}/<lang>/ for languages {', '.join(self.languages)})"
+                )
+
+
+    def site_for(self, file : Path) -> "Site | None":
+        for site in self.language_sites():
+            if file.is_relative_to(site.content_path):
+                return site
+        return None
+
+
+    @property
+    def staging_path(self) -> Path:
+        return self.build_root.with_name(f"{self.build_root.name}.staging")
+
+
+    @property
+    def previous_path(self) -> Path:
+        return self.build_root.with_name(f"{self.build_root.name}.previous")
+
+
+    @property
+    def preview_path(self) -> Path:
+        build : Path = Path(self.config['paths']['build'])
+        return build.with_name(f"{build.name}.preview")
+
+
+    @contextmanager
+    def staging(self):
+        """Build into a staging folder, switched in as the build folder only if the build succeeds"""
+        live : Path = self.build_root
+        staging : Path = self.staging_path
+        if staging.exists():
+            shutil.rmtree(staging)
+
+        self.discard_caches(pending=True)
+        self.set_build_root(staging, live if live.is_dir() else None)
+        try:
+            self.prepare_build()
+            yield
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            self.discard_caches(pending=True)
+            raise
+        finally:
+            self.set_build_root(live)
+
+        with self.metrics.phase("publish"):
+            publish(staging, live, self.previous_path)
+        self.commit_caches()
+
+
+    def rollback(self) -> bool:
+        """Swap the build folder with the one from the previous build"""
+        if not rollback(self.build_root, self.previous_path):
+            return False
+        self.discard_caches()       # they describe the build rolled back from
+        return True
+
+
+    @timed("prepare_build")
+    def prepare_build(self):
+        def copy(src, dst):
+            copy_output(Path(src), Path(dst), self.previous_output(Path(dst)))
+
+        shutil.copytree(self.static_path, self.build_path, copy_function=copy)
         self.load_templates()
 
-        for file in md_files:
-            page : Page = Page(file, self.config_file, self.content_path)
-            self.pages[file] = page
 
-            self.index_page(page)
-            self.convert_page(file, page)
+    def index_content(self):
+        """Prepare the preview folder and load page metadata, without converting any page.
+
+        `yogen serve` renders into its own folder, the build folder is only
+        ever replaced by a complete build.
+        """
+        self.check_languages()
+        preview : Path = self.preview_path
+        if preview.exists():
+            shutil.rmtree(preview)
+
+        self.set_build_root(preview)
+        self.prepare_build()
+        for site in self.language_sites():
+            site.load_pages()
+            site.copy_other_files()
 
 
     def build(self):
-        if self.build_path.exists() and self.build_path.is_dir():
-            shutil.rmtree(self.build_path)
+        self.check_languages()
+        with self.staging():
+            if self.translations:
+                self.build_languages()
+                self.convert_sitemap_index()
+            else:
+                self.build_content()
 
-        shutil.copytree(self.static_path, self.build_path)
 
+    def build_content(self):
         self.load_pages()
         self.convert_pages()
         self.copy_other_files()
+        self.convert_indexes()
+
+
+    def convert_indexes(self):
         self.convert_feed()
+        self.convert_search()
+        self.convert_sitemap()
+
+
+    @timed("build_languages")
+    def build_languages(self):
+        for translation in self.translations.values():
+            translation.metrics = Metrics()     # collected by the worker, merged back below
+
+        workers : int = min(len(self.translations), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results : list[dict] = list(pool.map(_build_content, self.translations.values()))
+
+        for result in results:
+            translation : Site = self.translations[result["language"]]
+            self.metrics.merge(result["metrics"])
+            translation.metrics = self.metrics
+            translation.sitemap.urlsets = result["urlsets"]
+            translation.page_files = result["pages"]
+
+
+    def shard_path(self, index : int, count : int) -> Path:
+        return self.build_root.with_name(f"{self.build_root.name}.shard-{index}-of-{count}")
+
+
+    def in_shard(self, file : Path, index : int, count : int) -> bool:
+        """Stable partition of content files: hash of the path relative to the content folder"""
+        key : bytes = file.relative_to(self.content_path).as_posix().encode("utf-8")
+        return int.from_bytes(hashlib.sha1(key).digest()[:8], "big") % count == index - 1
+
+
+    def build_shard(self, index : int, count : int) -> Path:
+        """Convert only the pages and files of shard `index` (1-based) of `count`.
+
+        Writes the partial output and a metadata bundle, combined by `merge`.
+        """
+        if not 1 <= index <= count:
+            raise ValueError(f"Invalid shard {index}/{count}")
+
+        live : Path = self.build_root
+        shard_path : Path = self.shard_path(index, count)
+        if shard_path.exists():
+            shutil.rmtree(shard_path)
+
+        self.check_languages()
+        select = lambda file: self.in_shard(file, index, count)
+        bundle : dict = {"shard": [index, count], "pages": []}
+
+        self.set_build_root(shard_path / "output")
+        try:
+            self.build_path.mkdir(parents=True)
+            self.load_templates()
+            for site in self.language_sites():
+                site.load_pages(select)
+                site.convert_pages()
+                site.copy_other_files(select)
+                for page in site.pages.values():
+                    bundle["pages"].append({"language": site.language, **page.to_metadata()})
+        finally:
+            self.set_build_root(live)
+
+        (shard_path / "bundle.json").write_text(json.dumps(bundle, default=str), encoding="utf-8")
+        return shard_path
+
+
+    def merge(self, shard_paths : list[Path]):
+        """Combine shard outputs into the build folder and write the feed, search and sitemap from their metadata"""
+        bundles : list[tuple[Path, dict]] = [
+            (path, json.loads((path / "bundle.json").read_text(encoding="utf-8"))) for path in shard_paths
+        ]
+        counts : set[int] = {bundle["shard"][1] for _, bundle in bundles}
+        indices : list[int] = sorted(bundle["shard"][0] for _, bundle in bundles)
+        if len(counts) != 1 or indices != list(range(1, counts.pop() + 1)):
+            raise RuntimeError(f"Incomplete or mixed shards: {[str(p) for p in shard_paths]}")
+
+        with self.staging():
+            for path, _ in bundles:
+                output_path : Path = path / "output"
+                for item in sorted(output_path.rglob("*")):
+                    if not item.is_file():
+                        continue
+                    target : Path = self.build_path / item.relative_to(output_path)
+                    target.parent.mkdir(parents=True, exist_ok=True)
+
+                    if target.exists():
+                        raise RuntimeError(
+                            f"Output path collision: {target} "
+                            f"({path} conflicts with another shard or a static file)"
+                        )
+
+                    copy_output(item, target, self.previous_output(target))
+
+            sites : dict[str, Site] = {site.language: site for site in self.language_sites()}
+            for site in sites.values():
+                site.clear_pages()
+            for _, bundle in bundles:
+                for data in bundle["pages"]:
+                    site : Site = sites[data["language"]]
+                    page : Page = Page.from_metadata(data, self.config)
+                    site.pages[page.file] = page
+                    site.index_page(page)
+
+            for site in self.language_sites():
+                site.convert_indexes()
+            self.convert_sitemap_index()
+
+
+    @timed("check")
+    def check(self) -> list[tuple[str, str]]:
+        """Return (source file, reference) for every broken internal link in the build folder"""
+        sources : dict[str, Path] = {}
+        for site in self.language_sites():
+            if not site.pages and not site.page_files:
+                site.load_pages()
+            for file in site.pages or site.page_files:
+                sources[site.page_output(file).relative_to(self.build_path).as_posix()] = file
+
+        checker : LinkChecker = LinkChecker(self.build_path, self.cache_path / "check.json")
+        broken : list[tuple[str, str]] = checker.check(sources)
+        self.metrics.increment("check.pages", len(checker.pages))
+        self.metrics.increment("check.pages_parsed", checker.parsed)
+        return broken
 
 
     def deploy(self):